@@ -1,26 +1,196 @@
-from typing import Dict, List, Any
+from typing import Awaitable, Callable, Deque, Dict, List, Any, Optional, TypeVar
+from collections import OrderedDict, deque
 from dataclasses import dataclass
 from datetime import datetime
+import asyncio
+import hashlib
+import httpx
 import openai
 import os
-import json
+import orjson
+import sqlite3
+import time
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+# Exact-match cache of temperature=0 completions, keyed by sha256(model|messages).
+# Module-level so that re-running main() in the same process skips the API entirely;
+# bounded as an LRU so long-running processes use constant memory.
+_RESPONSE_CACHE: "OrderedDict[str, str]" = OrderedDict()
+_RESPONSE_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+
+T = TypeVar("T")
+
+class TokenBucket:
+    """Token bucket limiting the estimated number of tokens sent per minute."""
+
+    def __init__(self, tokens_per_min: int):
+        self.capacity = tokens_per_min
+        self.tokens = float(tokens_per_min)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int) -> None:
+        """Wait until the bucket holds enough tokens, then take them."""
+        tokens = min(tokens, self.capacity)  # A larger request would otherwise wait forever
+        async with self.lock:  # Waiters are served in order
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 60)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) * 60 / self.capacity)
+
+class Resources:
+    """OpenAI client and rate limiters shared by the agents of one event loop.
+    
+    Async connections, locks and semaphores belong to the loop that first uses them,
+    so create one set per asyncio.run() and close it when the loop is done:
+    
+        async with Resources() as resources:
+            agent = Agent(resources=resources)
+    
+    - client: one keep-alive (HTTP/2) connection pool, so the sequential calls of a
+      query reuse the same TLS connection
+    - semaphore, token_bucket: client-side rate limiting sized to the account's limits
+    """
+
+    def __init__(self) -> None:
+        self.client = openai.AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+            )
+        )
+        self.semaphore = asyncio.Semaphore(int(os.getenv("OPENAI_MAX_CONCURRENCY", "8")))
+        self.token_bucket = TokenBucket(int(os.getenv("OPENAI_TPM_LIMIT", "200000")))
+
+    async def aclose(self) -> None:
+        """Close the connection pool."""
+        await self.client.close()
+
+    async def __aenter__(self) -> "Resources":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.aclose()
+
+@retry(
+    wait=wait_exponential(multiplier=1, max=60),
+    retry=retry_if_exception_type(openai.RateLimitError),
+    stop=stop_after_attempt(6),
+    reraise=True
+)
+async def call_with_retry(resources: Resources, create: Callable[..., Awaitable[Any]], **kwargs: Any) -> Any:
+    """Call an OpenAI endpoint within the rate limits, backing off exponentially on 429s."""
+    # Roughly 4 characters per token
+    estimated_tokens = sum(len(message["content"]) for message in kwargs.get("messages", [])) // 4
+    await resources.token_bucket.acquire(estimated_tokens)
+    async with resources.semaphore:
+        return await create(**kwargs)
+
+_SYSTEM_PROMPT_HEADER = """You are an AI assistant that helps users by providing direct answers or using tools when necessary.
+Configuration, instructions, and available tools are provided in JSON format below:"""
+
+_SYSTEM_PROMPT_FOOTER = """Always respond with a JSON object following the response_format schema above. 
+Remember to use tools only when they are actually needed for the task."""
+
+_REPLAN_SYSTEM = "You revise JSON plans. Output only the revised JSON, same schema."
+
+# The reflection request is static except for the query and the plan, so it is
+# serialized once and split around the two placeholders; each call concatenates the
+# pieces with the JSON-encoded query and plan
+_REFLECTION_TEMPLATE = orjson.dumps({
+    "task": "reflection",
+    "context": {
+        "user_query": "__Q__",
+        "generated_plan": "__P__"
+    },
+    "instructions": [
+        "Review the generated plan for potential improvements",
+        "Consider if the chosen tools are appropriate",
+        "Verify tool parameters are correct",
+        "Check if the plan is efficient",
+        "Determine if tools are actually needed"
+    ],
+    "response_format": {
+        "type": "json",
+        "schema": {
+            "requires_changes": {
+                "type": "boolean",
+                "description": "whether the plan needs modifications"
+            },
+            "reflection": {
+                "type": "string",
+                "description": "explanation of what changes are needed or why no changes are needed"
+            },
+            "suggestions": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "specific suggestions for improvements",
+                "optional": True
+            }
+        }
+    }
+}, option=orjson.OPT_INDENT_2).decode()
+_REFLECTION_PREFIX, _rest = _REFLECTION_TEMPLATE.split('"__Q__"')
+_REFLECTION_MIDDLE, _REFLECTION_SUFFIX = _rest.split('"__P__"')
 
 @dataclass
 class Interaction:
     """Record of a single interaction with the agent"""
-    timestamp: datetime
+    timestamp_ns: int  # Epoch nanoseconds; cheaper to record than a datetime
     query: str
     plan: Dict[str, Any]
+    rowid: Optional[int] = None  # SQLite row, set once the interaction is persisted
+
+    @property
+    def timestamp(self) -> datetime:
+        """Time of the interaction as a datetime."""
+        return datetime.fromtimestamp(self.timestamp_ns / 1e9)
 
 class Agent:
-    def __init__(self, model: str = "gpt-4o-mini"):
-        """Initialize Agent with empty interaction history."""
-        self.client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        self.interactions: List[Interaction] = []  # Working memory
+    def __init__(self, model: str = "gpt-4o-mini", resources: Optional[Resources] = None,
+                 memory_path: Optional[str] = None):
+        """Initialize Agent with empty interaction history.
+        
+        Agents of the same event loop should share one Resources; without one, the
+        agent creates its own and closes it in aclose(). If memory_path is given,
+        interactions are also persisted to that SQLite database so that they
+        survive process restarts.
+        """
+        self._owns_resources = resources is None
+        self.resources = resources or Resources()
+        # Working memory, bounded so long-running agents use constant memory
+        self.interactions: Deque[Interaction] = deque(maxlen=int(os.getenv("AGENT_MEMORY", "256")))
+        self.db: Optional[sqlite3.Connection] = None
+        if memory_path is not None:
+            self.db = sqlite3.connect(memory_path)
+            self.db.execute("CREATE TABLE IF NOT EXISTS interactions (timestamp_ns INTEGER, query TEXT, plan TEXT)")
         self.model = model
+        self._system_prompt: Optional[str] = None  # Serialized once, reused on every call
+
+    async def aclose(self) -> None:
+        """Close the SQLite database and release the resources owned by this agent."""
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+        if self._owns_resources:
+            await self.resources.aclose()
+
+    async def __aenter__(self) -> "Agent":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.aclose()
 
     def create_system_prompt(self) -> str:
         """Create the system prompt for the LLM with available tools."""
+        if self._system_prompt is not None:
+            return self._system_prompt
+
         tools_json = {
             "role": "AI Assistant",
             "capabilities": [
@@ -58,42 +228,19 @@ class Agent:
             "response_format": {
                 "type": "json",
                 "schema": {
-                    "requires_tools": {
-                        "type": "boolean",
-                        "description": "whether tools are needed for this query"
-                    },
-                    "direct_response": {
-                        "type": "string",
-                        "description": "response when no tools are needed",
-                        "optional": True
-                    },
-                    "thought": {
-                        "type": "string", 
-                        "description": "reasoning about how to solve the task (when tools are needed)",
-                        "optional": True
-                    },
-                    "plan": {
-                        "type": "array",
-                        "items": {"type": "string"},
-                        "description": "steps to solve the task (when tools are needed)",
-                        "optional": True
-                    },
+                    "requires_tools": {"type": "boolean"},
+                    "direct_response": {"type": "string", "optional": True},
+                    "thought": {"type": "string", "optional": True},
+                    "plan": {"type": "array", "items": {"type": "string"}, "optional": True},
                     "tool_calls": {
                         "type": "array",
                         "items": {
                             "type": "object",
                             "properties": {
-                                "tool": {
-                                    "type": "string",
-                                    "description": "name of the tool"
-                                },
-                                "args": {
-                                    "type": "object",
-                                    "description": "parameters for the tool"
-                                }
+                                "tool": {"type": "string"},
+                                "args": {"type": "object"}
                             }
                         },
-                        "description": "tools to call in sequence (when tools are needed)",
                         "optional": True
                     }
                 },
@@ -112,174 +259,214 @@ class Agent:
                                     "tool": "convert_currency",
                                     "args": {
                                         "amount": 100,
-                                        "from_currency": "USD", 
+                                        "from_currency": "USD",
                                         "to_currency": "EUR"
                                     }
                                 }
                             ]
                         }
-                    },
-                    {
-                        "query": "What's 500 Japanese Yen in British Pounds?",
-                        "response": {
-                            "requires_tools": True,
-                            "thought": "I need to convert JPY to GBP using the currency converter",
-                            "plan": [
-                                "Use convert_currency tool to convert 500 JPY to GBP",
-                                "Return the conversion result"
-                            ],
-                            "tool_calls": [
-                                {
-                                    "tool": "convert_currency",
-                                    "args": {
-                                        "amount": 500,
-                                        "from_currency": "JPY",
-                                        "to_currency": "GBP"
-                                    }
-                                }
-                            ]
-                        }
-                    },
-                    {
-                        "query": "What currency does Japan use?",
-                        "response": {
-                            "requires_tools": False,
-                            "direct_response": "Japan uses the Japanese Yen (JPY) as its official currency. This is common knowledge that doesn't require using the currency conversion tool."
-                        }
                     }
                 ]
             }
         }
         
-        return f"""You are an AI assistant that helps users by providing direct answers or using tools when necessary.
-Configuration, instructions, and available tools are provided in JSON format below:
+        # Compact JSON: whitespace from pretty-printing only adds input tokens
+        self._system_prompt = f"{_SYSTEM_PROMPT_HEADER}\n\n{orjson.dumps(tools_json).decode()}\n\n{_SYSTEM_PROMPT_FOOTER}"
+        return self._system_prompt
+
+    async def _cached_create(self, messages: List[Dict[str, str]], parse: Callable[[Any], T]) -> T:
+        """Return the parsed completion for messages, calling the API only on a cache miss.
+        
+        Errors raised by parse propagate to the caller. A completion is only cached
+        once it finished normally and parse accepted it, so a refusal, truncated or
+        malformed response is requested again next time instead of being replayed.
+        """
+        key = hashlib.sha256(
+            orjson.dumps({"model": self.model, "messages": messages}, option=orjson.OPT_SORT_KEYS)
+        ).hexdigest()
+        if key in _RESPONSE_CACHE:
+            _RESPONSE_CACHE.move_to_end(key)
+            return parse(_RESPONSE_CACHE[key])
+        
+        response = await call_with_retry(
+            self.resources,
+            self.resources.client.chat.completions.create,
+            model=self.model,
+            messages=messages,
+            temperature=0,
+            response_format={"type": "json_object"}  # Guarantees parseable JSON output
+        )
+        choice = response.choices[0]
+        result = parse(choice.message.content)
+        if choice.finish_reason == "stop":
+            _RESPONSE_CACHE[key] = choice.message.content
+            if len(_RESPONSE_CACHE) > _RESPONSE_CACHE_SIZE:
+                _RESPONSE_CACHE.popitem(last=False)  # Evict the least recently used response
+        return result
 
-{json.dumps(tools_json, indent=2)}
+    def remember(self, interaction: Interaction) -> None:
+        """Store an interaction in working memory and, if configured, in SQLite."""
+        self.interactions.append(interaction)
+        self._persist(interaction)
 
-Always respond with a JSON object following the response_format schema above. 
-Remember to use tools only when they are actually needed for the task."""
+    def _persist(self, interaction: Interaction) -> None:
+        """Insert or update the SQLite row of an interaction."""
+        if self.db is None:
+            return
+        plan = orjson.dumps(interaction.plan).decode()
+        with self.db:
+            # Updates address the row by rowid, so neither path scans the table
+            if interaction.rowid is None:
+                cursor = self.db.execute(
+                    "INSERT INTO interactions VALUES (?, ?, ?)", (interaction.timestamp_ns, interaction.query, plan)
+                )
+                interaction.rowid = cursor.lastrowid
+            else:
+                self.db.execute("UPDATE interactions SET plan = ? WHERE rowid = ?", (plan, interaction.rowid))
+
+    def latest_interaction(self) -> Optional[Interaction]:
+        """Get the most recent interaction, falling back to SQLite after a restart."""
+        if self.interactions:
+            return self.interactions[-1]
+        if self.db is None:
+            return None
+        row = self.db.execute(
+            "SELECT rowid, timestamp_ns, query, plan FROM interactions ORDER BY rowid DESC LIMIT 1"
+        ).fetchone()
+        if row is None:
+            return None
+        return Interaction(timestamp_ns=row[1], query=row[2], plan=orjson.loads(row[3]), rowid=row[0])
 
-    def plan(self, user_query: str) -> Dict:
+    async def plan(self, user_query: str) -> Dict:
         """Use LLM to create a plan and store it in memory."""
+        interaction = await self._plan(user_query)
+        return interaction.plan
+
+    async def _plan(self, user_query: str) -> Interaction:
+        """Create a plan and return the interaction it was stored in."""
         messages = [
             {"role": "system", "content": self.create_system_prompt()},
             {"role": "user", "content": user_query}
         ]
         
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            temperature=0
-        )
-        
         try:
-            plan = json.loads(response.choices[0].message.content)
+            plan = await self._cached_create(messages, orjson.loads)
             # Store the interaction immediately after planning
             interaction = Interaction(
-                timestamp=datetime.now(),
+                timestamp_ns=time.time_ns(),
                 query=user_query,
                 plan=plan
             )
-            self.interactions.append(interaction)
-            return plan
-        except json.JSONDecodeError:
+            self.remember(interaction)
+            return interaction
+        except orjson.JSONDecodeError:
             raise ValueError("Failed to parse LLM response as JSON")
 
-    def reflect_on_plan(self) -> Dict[str, Any]:
-        """Reflect on the most recent plan using interaction history."""
-        if not self.interactions:
-            return {"reflection": "No plan to reflect on", "requires_changes": False}
+    async def plan_many(self, user_queries: List[str], k: int = 10) -> List[Dict]:
+        """Plan several queries with one LLM request per k queries and store each in memory."""
+        async def plan_chunk(queries: List[str]) -> List[Dict]:
+            messages = [
+                {"role": "system", "content": self.create_system_prompt()},
+                {"role": "user", "content": (
+                    'Return a JSON object with a "plans" array where element i is the plan '
+                    f"for query i, each following the response_format schema. Queries: {orjson.dumps(queries).decode()}"
+                )}
+            ]
+            
+            def parse_plans(content: Any) -> List[Dict]:
+                try:
+                    plans = orjson.loads(content)["plans"]
+                except (orjson.JSONDecodeError, KeyError, TypeError):
+                    raise ValueError("Failed to parse LLM response as a JSON array of plans")
+                if len(plans) != len(queries):
+                    raise ValueError(f"Expected {len(queries)} plans, got {len(plans)}")
+                return plans
+            
+            return await self._cached_create(messages, parse_plans)
         
-        latest_interaction = self.interactions[-1]
+        chunks = [user_queries[i:i + k] for i in range(0, len(user_queries), k)]
+        chunk_plans = await asyncio.gather(*(plan_chunk(chunk) for chunk in chunks))
         
-        reflection_prompt = {
-            "task": "reflection",
-            "context": {
-                "user_query": latest_interaction.query,
-                "generated_plan": latest_interaction.plan
-            },
-            "instructions": [
-                "Review the generated plan for potential improvements",
-                "Consider if the chosen tools are appropriate",
-                "Verify tool parameters are correct",
-                "Check if the plan is efficient",
-                "Determine if tools are actually needed"
-            ],
-            "response_format": {
-                "type": "json",
-                "schema": {
-                    "requires_changes": {
-                        "type": "boolean",
-                        "description": "whether the plan needs modifications"
-                    },
-                    "reflection": {
-                        "type": "string",
-                        "description": "explanation of what changes are needed or why no changes are needed"
-                    },
-                    "suggestions": {
-                        "type": "array",
-                        "items": {"type": "string"},
-                        "description": "specific suggestions for improvements",
-                        "optional": True
-                    }
-                }
-            }
-        }
+        plans = [plan for chunk in chunk_plans for plan in chunk]
+        for user_query, plan in zip(user_queries, plans):
+            self.remember(Interaction(
+                timestamp_ns=time.time_ns(),
+                query=user_query,
+                plan=plan
+            ))
+        return plans
+
+    async def reflect_on_plan(self, interaction: Optional[Interaction] = None) -> Dict[str, Any]:
+        """Reflect on a plan, by default the most recent one in interaction history."""
+        if interaction is None:
+            interaction = self.latest_interaction()
+            if interaction is None:
+                return {"reflection": "No plan to reflect on", "requires_changes": False}
+        
+        reflection_prompt = (_REFLECTION_PREFIX + orjson.dumps(interaction.query).decode()
+                             + _REFLECTION_MIDDLE + orjson.dumps(interaction.plan).decode()
+                             + _REFLECTION_SUFFIX)
         
         messages = [
             {"role": "system", "content": self.create_system_prompt()},
-            {"role": "user", "content": json.dumps(reflection_prompt, indent=2)}
+            {"role": "user", "content": reflection_prompt}
         ]
         
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            temperature=0
-        )
-        
         try:
-            return json.loads(response.choices[0].message.content)
-        except json.JSONDecodeError:
-            return {"reflection": response.choices[0].message.content}
+            return await self._cached_create(messages, orjson.loads)
+        except orjson.JSONDecodeError as e:
+            return {"reflection": e.doc}  # The unparsed response text
 
-    def execute(self, user_query: str) -> str:
+    async def execute(self, user_query: str) -> str:
         """Execute the full pipeline: plan, reflect, and potentially replan."""
         try:
             # Create initial plan (this also stores it in memory)
-            initial_plan = self.plan(user_query)
+            # Keep a handle on our own interaction: other queries may be
+            # appended to memory while we wait on the API
+            interaction = await self._plan(user_query)
+            initial_plan = interaction.plan
+            
+            # A direct response has no tool usage to reflect on, so skip the round-trip
+            if not initial_plan.get("requires_tools", True):
+                interaction.plan = {
+                    "initial_plan": initial_plan,
+                    "reflection": None,
+                    "final_plan": initial_plan
+                }
+                self._persist(interaction)
+                return f"Response: {initial_plan['direct_response']}"
             
             # Reflect on the plan using memory
-            reflection = self.reflect_on_plan()
+            reflection = await self.reflect_on_plan(interaction)
             
             # Check if reflection suggests changes
             if reflection.get("requires_changes", False):
-                # Generate new plan based on reflection
+                # Generate new plan based on reflection; patching the plan only needs
+                # the plan and the feedback, not the full system prompt and examples
                 messages = [
-                    {"role": "system", "content": self.create_system_prompt()},
-                    {"role": "user", "content": user_query},
-                    {"role": "assistant", "content": json.dumps(initial_plan)},
-                    {"role": "user", "content": f"Please revise the plan based on this feedback: {json.dumps(reflection)}"}
+                    {"role": "system", "content": _REPLAN_SYSTEM},
+                    {"role": "user", "content": (
+                        f"Query:\n{user_query}\n"
+                        f"Plan:\n{orjson.dumps(initial_plan).decode()}\n"
+                        f"Feedback:\n{orjson.dumps(reflection).decode()}\n"
+                        "Revised plan:"
+                    )}
                 ]
                 
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    temperature=0
-                )
-                
                 try:
-                    final_plan = json.loads(response.choices[0].message.content)
-                except json.JSONDecodeError:
+                    final_plan = await self._cached_create(messages, orjson.loads)
+                except orjson.JSONDecodeError:
                     final_plan = initial_plan  # Fallback to initial plan if parsing fails
             else:
                 final_plan = initial_plan
             
             # Update the stored interaction with all information
-            self.interactions[-1].plan = {
+            interaction.plan = {
                 "initial_plan": initial_plan,
                 "reflection": reflection,
                 "final_plan": final_plan
             }
+            self._persist(interaction)
             
             # Return the appropriate response
             if final_plan.get("requires_tools", True):
@@ -294,16 +481,19 @@ Reflection: {reflection.get('reflection', 'No improvements suggested')}"""
         except Exception as e:
             return f"Error executing plan: {str(e)}"
 
-def main():
-    agent = Agent(model="gpt-4o-mini")
-    
+async def main():
     query_list = ["I am traveling to Japan from Lithuania, I have 1500 of local currency, how much of Japaese currency will I be able to get?",
                   "How are you doing?"]
     
-    for query in query_list:
+    async with Resources() as resources:
+        agent = Agent(model="gpt-4o-mini", resources=resources)
+        # Queries are independent, so run them concurrently; call_with_retry keeps
+        # the resulting API calls within the account's rate limits
+        results = await asyncio.gather(*(agent.execute(query) for query in query_list))
+    
+    for query, result in zip(query_list, results):
         print(f"\nQuery: {query}")
-        result = agent.execute(query)
         print(result)
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
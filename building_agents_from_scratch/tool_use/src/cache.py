@@ -0,0 +1,79 @@
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+import openai
+import orjson
+from retry import call_with_retry
+
+try:
+    import faiss
+except ImportError:  # faiss is optional, only used for large caches
+    faiss = None
+
+
+class LLMCache:
+    """In-memory semantic cache of plans keyed by the embedding of the user query.
+    
+    Only direct responses are cached. Plans with tool calls carry query-specific
+    arguments ("Convert 100 USD to EUR" vs "Convert 250 USD to EUR" embed almost
+    identically), so replaying them for a similar query would give a wrong result.
+    """
+
+    FAISS_THRESHOLD = 10_000  # Above this many entries, search with faiss if it is installed
+
+    def __init__(self, client: openai.OpenAI, model: str = "text-embedding-3-small", threshold: float = 0.92):
+        """Initialize an empty cache using the given client for embeddings."""
+        self.client = client
+        self.model = model
+        self.threshold = threshold
+        self.entries: List[Tuple[str, bytes]] = []  # (query, plan_json), row i of the embedding matrix
+        # L2-normalized float32 embeddings, one row per entry; allocated with spare
+        # capacity that doubles when full, so inserts don't copy the whole matrix
+        self._emb_matrix: Optional[np.ndarray] = None
+        self._index: Any = None  # faiss.IndexFlatIP once the cache outgrows FAISS_THRESHOLD
+
+    def embed(self, text: str) -> np.ndarray:
+        """Embed text with the configured embedding model."""
+        response = call_with_retry(self.client.embeddings.create, model=self.model, input=text)
+        embedding = np.asarray(response.data[0].embedding, dtype=np.float32)
+        # Normalized vectors make cosine similarity a plain dot product
+        return embedding / np.linalg.norm(embedding)
+
+    def lookup(self, embedding: np.ndarray) -> Optional[Dict[str, Any]]:
+        """Return the cached plan of the most similar query if it is above the threshold."""
+        if not self.entries or self._emb_matrix is None:
+            return None
+        
+        if self._index is not None:
+            similarities, indices = self._index.search(embedding.reshape(1, -1), 1)
+            best, similarity = int(indices[0][0]), float(similarities[0][0])
+        else:
+            # One BLAS matrix-vector product over all cached embeddings
+            similarities = self._emb_matrix[:len(self.entries)] @ embedding
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+        
+        if similarity > self.threshold:
+            # Decode a fresh copy so callers can't mutate the cached plan
+            return orjson.loads(self.entries[best][1])
+        return None
+
+    def store(self, embedding: np.ndarray, query: str, plan: Dict[str, Any]) -> None:
+        """Add a plan to the cache if it is a direct response."""
+        if plan.get("requires_tools", True):
+            return
+        
+        size = len(self.entries)
+        if self._emb_matrix is None:
+            self._emb_matrix = np.empty((16, embedding.shape[0]), dtype=np.float32)
+        elif size == self._emb_matrix.shape[0]:
+            grown = np.empty((size * 2, self._emb_matrix.shape[1]), dtype=np.float32)
+            grown[:size] = self._emb_matrix
+            self._emb_matrix = grown
+        self._emb_matrix[size] = embedding
+        self.entries.append((query, orjson.dumps(plan)))
+        
+        if self._index is not None:
+            self._index.add(embedding.reshape(1, -1))
+        elif faiss is not None and len(self.entries) > self.FAISS_THRESHOLD:
+            self._index = faiss.IndexFlatIP(self._emb_matrix.shape[1])
+            self._index.add(self._emb_matrix[:len(self.entries)])
\ No newline at end of file
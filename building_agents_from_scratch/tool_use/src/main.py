@@ -1,19 +1,77 @@
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Callable, Optional
+from concurrent.futures import Future
 from tool_registry import Tool
+from cache import LLMCache
+from resources import get_ctx
+from retry import call_with_retry
 import openai
-import os
-import json
+import orjson
+import time
+
+
+_SYSTEM_PROMPT_HEADER = """You are an AI assistant that helps users by providing direct answers or using tools when necessary.
+Configuration and instructions are provided in JSON format below:"""
+
+_SYSTEM_PROMPT_FOOTER = "Remember to use tools only when they are actually needed for the task."
+
+
+class JsonScanner:
+    """Tracks whether streamed JSON text has formed a complete object or array.
+    
+    Each chunk is scanned once, keeping only the nesting depth and string state, so
+    checking completeness after every chunk is linear overall and builds no objects.
+    """
+
+    def __init__(self) -> None:
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escaped = False
+        self.complete = False
+
+    def feed(self, chunk: str) -> bool:
+        """Scan the next chunk and return whether the JSON value is complete."""
+        for char in chunk:
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{" or char == "[":
+                self.depth += 1
+                self.started = True
+            elif char == "}" or char == "]":
+                self.depth -= 1
+                if self.started and self.depth == 0:
+                    self.complete = True
+        return self.complete
 
 
 class Agent:
-    def __init__(self):
-        """Initialize Agent with empty tool registry."""
-        self.client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def __init__(self, model: str = "gpt-4o-mini", client: Optional[openai.OpenAI] = None,
+                 cache: Optional[LLMCache] = None):
+        """Initialize Agent with empty tool registry.
+        
+        Pass cache=get_ctx().cache to share one semantic cache between agents.
+        """
+        ctx = get_ctx()
+        self.client = client or ctx.openai
+        self.model = model
+        self.cache = cache  # Optional semantic cache of plans
         self.tools: Dict[str, Tool] = {}
+        # Tools are mostly I/O bound (HTTP calls), so threads let independent calls overlap
+        self._tool_pool = ctx.tool_pool
+        self._system_prompt: Optional[str] = None  # Serialized once, reused on every call
+        self._tool_specs: Optional[List[Dict[str, Any]]] = None  # Rebuilt only when the tool set changes
     
     def add_tool(self, tool: Tool) -> None:
         """Register a new tool with the agent."""
         self.tools[tool.name] = tool
+        self._tool_specs = None
     
     def get_available_tools(self) -> List[str]:
         """Get list of available tool descriptions."""
@@ -27,9 +85,19 @@ class Agent:
         tool = self.tools[tool_name]
         return tool.func(**kwargs)
 
+    def _use_tool_isolated(self, tool_call: Dict[str, Any]) -> str:
+        """Execute a planned tool call, turning failures into an error string."""
+        try:
+            return self.use_tool(tool_call["tool"], **tool_call["args"])
+        except Exception as e:
+            return f"Error using tool '{tool_call.get('tool')}': {str(e)}"
+
     def create_system_prompt(self) -> str:
-        """Create the system prompt for the LLM with available tools."""
-        tools_json = {
+        """Create the system prompt for the LLM; tools are passed separately via the API."""
+        if self._system_prompt is not None:
+            return self._system_prompt
+
+        config_json = {
             "role": "AI Assistant",
             "capabilities": [
                 "Using provided tools to help users when necessary",
@@ -39,168 +107,213 @@ class Agent:
             "instructions": [
                 "Use tools only when they are necessary for the task",
                 "If a query can be answered directly, respond with a simple message instead of using tools",
-                "When tools are needed, plan their usage efficiently to minimize tool calls"
-            ],
-            "tools": [
-                {
-                    "name": tool.name,
-                    "description": tool.description,
-                    "parameters": {
-                        name: {
-                            "type": info["type"],
-                            "description": info["description"]
-                        }
-                        for name, info in tool.parameters.items()
-                    }
-                }
-                for tool in self.tools.values()
-            ],
-            "response_format": {
-                "type": "json",
-                "schema": {
-                    "requires_tools": {
-                        "type": "boolean",
-                        "description": "whether tools are needed for this query"
-                    },
-                    "direct_response": {
-                        "type": "string",
-                        "description": "response when no tools are needed",
-                        "optional": True
-                    },
-                    "thought": {
-                        "type": "string", 
-                        "description": "reasoning about how to solve the task (when tools are needed)",
-                        "optional": True
-                    },
-                    "plan": {
-                        "type": "array",
-                        "items": {"type": "string"},
-                        "description": "steps to solve the task (when tools are needed)",
-                        "optional": True
-                    },
-                    "tool_calls": {
-                        "type": "array",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "tool": {
-                                    "type": "string",
-                                    "description": "name of the tool"
-                                },
-                                "args": {
-                                    "type": "object",
-                                    "description": "parameters for the tool"
-                                }
-                            }
-                        },
-                        "description": "tools to call in sequence (when tools are needed)",
-                        "optional": True
-                    }
-                },
-                "examples": [
-                    {
-                        "query": "Convert 100 USD to EUR",
-                        "response": {
-                            "requires_tools": True,
-                            "thought": "I need to use the currency conversion tool to convert USD to EUR",
-                            "plan": [
-                                "Use convert_currency tool to convert 100 USD to EUR",
-                                "Return the conversion result"
-                            ],
-                            "tool_calls": [
-                                {
-                                    "tool": "convert_currency",
-                                    "args": {
-                                        "amount": 100,
-                                        "from_currency": "USD", 
-                                        "to_currency": "EUR"
-                                    }
-                                }
-                            ]
-                        }
-                    },
-                    {
-                        "query": "What's 500 Japanese Yen in British Pounds?",
-                        "response": {
-                            "requires_tools": True,
-                            "thought": "I need to convert JPY to GBP using the currency converter",
-                            "plan": [
-                                "Use convert_currency tool to convert 500 JPY to GBP",
-                                "Return the conversion result"
-                            ],
-                            "tool_calls": [
-                                {
-                                    "tool": "convert_currency",
-                                    "args": {
-                                        "amount": 500,
-                                        "from_currency": "JPY",
-                                        "to_currency": "GBP"
-                                    }
-                                }
-                            ]
-                        }
-                    },
-                    {
-                        "query": "What currency does Japan use?",
-                        "response": {
-                            "requires_tools": False,
-                            "direct_response": "Japan uses the Japanese Yen (JPY) as its official currency. This is common knowledge that doesn't require using the currency conversion tool."
-                        }
-                    }
-                ]
-            }
+                "When tools are needed, plan their usage efficiently to minimize tool calls",
+                "When calling tools, briefly state your reasoning in the message content"
+            ]
         }
         
-        return f"""You are an AI assistant that helps users by providing direct answers or using tools when necessary.
-Configuration, instructions, and available tools are provided in JSON format below:
-
-{json.dumps(tools_json, indent=2)}
+        # Compact JSON: whitespace from pretty-printing only adds input tokens
+        self._system_prompt = f"{_SYSTEM_PROMPT_HEADER}\n\n{orjson.dumps(config_json).decode()}\n\n{_SYSTEM_PROMPT_FOOTER}"
+        return self._system_prompt
 
-Always respond with a JSON object following the response_format schema above. 
-Remember to use tools only when they are actually needed for the task."""
+    def get_tool_specs(self) -> List[Dict[str, Any]]:
+        """Get the registered tools in OpenAI's function-calling format."""
+        if self._tool_specs is None:
+            self._tool_specs = [tool.to_openai_tool() for tool in self.tools.values()]
+        return self._tool_specs
 
-    def plan(self, user_query: str) -> Dict:
-        """Use LLM to create a plan for tool usage."""
+    def plan(self, user_query: str,
+             on_tool_call: Optional[Callable[[Dict[str, Any]], None]] = None,
+             temperature: float = 0) -> Dict:
+        """Use LLM to create a plan for tool usage.
+        
+        The completion is streamed, and on_tool_call (if given) is invoked for each
+        tool call as soon as its arguments are complete, before the rest of the plan has arrived.
+        The semantic cache is only used at temperature 0.
+        """
+        # Only deterministic completions are safe to reuse for similar queries
+        cache = self.cache if temperature == 0 else None
+        if cache is not None:
+            embedding = cache.embed(user_query)
+            cached_plan = cache.lookup(embedding)
+            if cached_plan is not None:
+                return cached_plan
+        
         messages = [
             {"role": "system", "content": self.create_system_prompt()},
             {"role": "user", "content": user_query}
         ]
         
-        response = self.client.chat.completions.create(
-            model="gpt-4o-mini",
+        stream = call_with_retry(
+            self.client.chat.completions.create,
+            model=self.model,
             messages=messages,
-            temperature=0
+            tools=self.get_tool_specs() or openai.NOT_GIVEN,
+            temperature=temperature,
+            stream=True
         )
         
+        # Deltas are collected in lists and joined on demand, avoiding quadratic string concatenation
+        content_chunks: List[str] = []
+        tool_names: Dict[int, str] = {}
+        argument_chunks: Dict[int, List[str]] = {}
+        argument_scanners: Dict[int, JsonScanner] = {}
+        tool_calls: Dict[int, Dict[str, Any]] = {}
+        
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                content_chunks.append(delta.content)
+            for tool_call_delta in delta.tool_calls or []:
+                index = tool_call_delta.index
+                function = tool_call_delta.function
+                if function is None:
+                    continue
+                if function.name:
+                    tool_names[index] = function.name
+                if function.arguments:
+                    argument_chunks.setdefault(index, []).append(function.arguments)
+                    scanner = argument_scanners.setdefault(index, JsonScanner())
+                    # Parse once, when the scanner first sees the closing brace of the arguments;
+                    # if that fails, the call is left to the final parse after the stream ends
+                    if not scanner.complete and scanner.feed(function.arguments):
+                        try:
+                            args = orjson.loads("".join(argument_chunks[index]))
+                        except orjson.JSONDecodeError:
+                            continue
+                        tool_calls[index] = {"tool": tool_names[index], "args": args}
+                        if on_tool_call is not None:
+                            on_tool_call(tool_calls[index])
+        
         try:
-            return json.loads(response.choices[0].message.content)
-        except json.JSONDecodeError:
-            raise ValueError("Failed to parse LLM response as JSON")
+            for index in tool_names:
+                if index not in tool_calls:
+                    tool_calls[index] = {
+                        "tool": tool_names[index],
+                        "args": orjson.loads("".join(argument_chunks.get(index, [])) or "{}")
+                    }
+        except orjson.JSONDecodeError:
+            raise ValueError("Failed to parse tool call arguments as JSON")
+        
+        plan = self._build_plan("".join(content_chunks), [tool_calls[index] for index in sorted(tool_calls)])
+        
+        if cache is not None:
+            cache.store(embedding, user_query, plan)
+        return plan
+
+    @staticmethod
+    def _build_plan(content: str, tool_calls: List[Dict[str, Any]]) -> Dict:
+        """Turn the model's message content and tool calls into a plan."""
+        if not tool_calls:
+            return {"requires_tools": False, "direct_response": content}
+        return {
+            "requires_tools": True,
+            "thought": content or "I need to use the available tools to answer this query",
+            "plan": [f"Use {call['tool']} tool with {orjson.dumps(call['args']).decode()}" for call in tool_calls],
+            "tool_calls": tool_calls
+        }
+
+    def _run_plan(self, plan: Dict, futures: Dict[int, Future]) -> str:
+        """Execute the tool calls of a plan that haven't been dispatched yet and combine the results."""
+        if not plan.get("requires_tools", True):
+            return plan["direct_response"]
+        
+        for tool_call in plan["tool_calls"]:
+            if id(tool_call) not in futures:
+                futures[id(tool_call)] = self._tool_pool.submit(self._use_tool_isolated, tool_call)
+        results = [futures[id(tool_call)].result() for tool_call in plan["tool_calls"]]
+        
+        # Combine results
+        return f"""Thought: {plan['thought']}
+Plan: {'. '.join(plan['plan'])}
+Results: {'. '.join(results)}"""
 
     def execute(self, user_query: str) -> str:
         """Execute the full pipeline: plan and execute tools."""
         try:
-            plan = self.plan(user_query)
+            # Tool calls are executed concurrently and start while the plan is
+            # still streaming; a failing call doesn't prevent the others from completing
+            futures: Dict[int, Future] = {}  # id(tool_call) -> pending result
             
-            if not plan.get("requires_tools", True):
-                return plan["direct_response"]
+            def dispatch(tool_call: Dict[str, Any]) -> None:
+                futures[id(tool_call)] = self._tool_pool.submit(self._use_tool_isolated, tool_call)
             
-            # Execute each tool in sequence
-            results = []
-            for tool_call in plan["tool_calls"]:
-                tool_name = tool_call["tool"]
-                tool_args = tool_call["args"]
-                result = self.use_tool(tool_name, **tool_args)
-                results.append(result)
-            
-            # Combine results
-            return f"""Thought: {plan['thought']}
-Plan: {'. '.join(plan['plan'])}
-Results: {'. '.join(results)}"""
+            plan = self.plan(user_query, on_tool_call=dispatch)
+            return self._run_plan(plan, futures)
             
         except Exception as e:
             return f"Error executing plan: {str(e)}"
 
+    def batch_execute(self, queries: List[str], poll_interval: float = 30.0) -> List[str]:
+        """Plan queries through the OpenAI Batch API, then execute their tools locally.
+        
+        Batches cost half as much and use a separate rate limit pool, but may take
+        up to 24 hours to complete, so this is meant for offline or bulk workloads.
+        """
+        rows: List[Dict[str, Any]] = [
+            {
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": self.model,
+                    "messages": [
+                        {"role": "system", "content": self.create_system_prompt()},
+                        {"role": "user", "content": query}
+                    ],
+                    "temperature": 0
+                }
+            }
+            for i, query in enumerate(queries)
+        ]
+        # The API rejects an empty tools array, so only send it when tools are registered
+        tool_specs = self.get_tool_specs()
+        if tool_specs:
+            for row in rows:
+                row["body"]["tools"] = tool_specs
+        batch_file = self.client.files.create(
+            file=("batch.jsonl", b"\n".join(orjson.dumps(row) for row in rows)),
+            purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(poll_interval)
+            batch = self.client.batches.retrieve(batch.id)
+        
+        if batch.status != "completed" or not batch.output_file_id:
+            return [f"Error executing plan: batch {batch.status}" for _ in queries]
+        
+        # Output rows are not guaranteed to be in input order
+        messages: Dict[str, Dict[str, Any]] = {}
+        for line in self.client.files.content(batch.output_file_id).text.splitlines():
+            result = orjson.loads(line)
+            if result.get("response") and result["response"]["status_code"] == 200:
+                messages[result["custom_id"]] = result["response"]["body"]["choices"][0]["message"]
+        
+        results = []
+        for i in range(len(queries)):
+            message = messages.get(str(i))
+            if message is None:
+                results.append("Error executing plan: no successful response in batch output")
+                continue
+            try:
+                tool_calls = [
+                    {"tool": call["function"]["name"], "args": orjson.loads(call["function"]["arguments"])}
+                    for call in message.get("tool_calls") or []
+                ]
+                plan = self._build_plan(message.get("content") or "", tool_calls)
+                results.append(self._run_plan(plan, {}))
+            except Exception as e:
+                results.append(f"Error executing plan: {str(e)}")
+        return results
+
 def main():
     from tools import convert_currency
     
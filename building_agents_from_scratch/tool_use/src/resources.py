@@ -0,0 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from types import SimpleNamespace
+import httpx
+import os
+
+# Process-wide resources shared by every Agent and tool, so that running many agents
+# (e.g. subagents) doesn't multiply connection pools, threads and caches. Each one is
+# created on first use, so importing the tools doesn't require OPENAI_API_KEY, and
+# the OpenAI client and cache are imported lazily so that tools only pull in httpx.
+
+@lru_cache(maxsize=None)
+def get_http() -> httpx.Client:
+    """One keep-alive (HTTP/2) connection pool for OpenAI and tool HTTP calls."""
+    return httpx.Client(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+    )
+
+@lru_cache(maxsize=None)
+def get_tool_pool() -> ThreadPoolExecutor:
+    """Threads for executing I/O bound tool calls concurrently."""
+    return ThreadPoolExecutor(max_workers=int(os.getenv("TOOL_CONCURRENCY_LIMIT", "16")))
+
+@lru_cache(maxsize=None)
+def get_ctx() -> SimpleNamespace:
+    """Shared agent resources: openai (client on top of the HTTP pool), tool_pool and cache."""
+    import openai
+    from cache import LLMCache
+    
+    client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=get_http())
+    return SimpleNamespace(
+        openai=client,
+        tool_pool=get_tool_pool(),
+        cache=LLMCache(client)
+    )
\ No newline at end of file
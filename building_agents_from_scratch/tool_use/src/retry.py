@@ -0,0 +1,14 @@
+from typing import Any, Callable
+import openai
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+
+@retry(
+    wait=wait_exponential(multiplier=1, max=60),
+    retry=retry_if_exception_type(openai.RateLimitError),
+    stop=stop_after_attempt(6),
+    reraise=True
+)
+def call_with_retry(create: Callable[..., Any], **kwargs: Any) -> Any:
+    """Call an OpenAI endpoint, backing off exponentially on rate limit errors."""
+    return create(**kwargs)
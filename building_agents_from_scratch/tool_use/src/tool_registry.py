@@ -1,7 +1,7 @@
-from typing import Callable, Any, Dict, get_type_hints, Optional
-from dataclasses import dataclass
+from typing import Callable, Any, Dict, Literal, get_origin, get_type_hints, Optional
+from dataclasses import dataclass, field
 import inspect
-from typing import _GenericAlias
+from typing import _GenericAlias  # type: ignore[attr-defined]
 
 @dataclass
 class Tool:
@@ -9,10 +9,22 @@ class Tool:
     description: str
     func: Callable[..., str]
     parameters: Dict[str, Dict[str, str]]
+    json_schema: Dict[str, Any] = field(default_factory=dict)
     
     def __call__(self, *args, **kwargs) -> str:
         return self.func(*args, **kwargs)
 
+    def to_openai_tool(self) -> Dict[str, Any]:
+        """Describe the tool in OpenAI's function-calling format."""
+        return {
+            "type": "function",
+            "function": {
+                "name": self.name,
+                "description": self.description,
+                "parameters": self.json_schema
+            }
+        }
+
 def parse_docstring_params(docstring: str) -> Dict[str, str]:
     """Extract parameter descriptions from docstring."""
     if not docstring:
@@ -45,7 +57,16 @@ def get_type_description(type_hint: Any) -> str:
             return f"one of {type_hint.__args__}"
     return type_hint.__name__
 
-def tool(name: str = None):
+JSON_TYPES = {str: "string", int: "integer", float: "number", bool: "boolean", list: "array", dict: "object"}
+
+def get_json_schema(type_hint: Any) -> Dict[str, Any]:
+    """Get the JSON schema of a type hint for function calling."""
+    if get_origin(type_hint) is Literal:
+        return {"enum": list(type_hint.__args__)}
+    json_type = JSON_TYPES.get(get_origin(type_hint) or type_hint)
+    return {"type": json_type} if json_type else {}
+
+def tool(name: Optional[str] = None) -> Callable[[Callable[..., str]], Tool]:
     def decorator(func: Callable[..., str]) -> Tool:
         tool_name = name or func.__name__
         description = inspect.getdoc(func) or "No description available"
@@ -55,16 +76,25 @@ def tool(name: str = None):
         sig = inspect.signature(func)
         
         params = {}
+        properties = {}
+        required = []
         for param_name, param in sig.parameters.items():
             params[param_name] = {
                 "type": get_type_description(type_hints.get(param_name, Any)),
                 "description": param_docs.get(param_name, "No description available")
             }
+            properties[param_name] = {
+                **get_json_schema(type_hints.get(param_name, Any)),
+                "description": params[param_name]["description"]
+            }
+            if param.default is inspect.Parameter.empty:
+                required.append(param_name)
         
         return Tool(
             name=tool_name,
             description=description.split('\n\n')[0],
             func=func,
-            parameters=params
+            parameters=params,
+            json_schema={"type": "object", "properties": properties, "required": required}
         )
     return decorator
\ No newline at end of file
@@ -1,6 +1,28 @@
+from typing import Dict, Optional, Tuple
 from tool_registry import tool
-import urllib.request
-import json
+from resources import get_http
+import orjson
+import time
+
+# Exchange rates per source currency: from_currency -> (fetched_at, rates)
+_RATES_CACHE: Dict[str, Tuple[float, Dict[str, float]]] = {}
+_RATES_TTL_SECONDS = 3600  # The API refreshes rates at most hourly
+
+def _get_rates(from_currency: str) -> Optional[Dict[str, float]]:
+    """Fetch exchange rates for a currency, reusing cached rates within the TTL."""
+    cached = _RATES_CACHE.get(from_currency)
+    if cached and time.time() - cached[0] < _RATES_TTL_SECONDS:
+        return cached[1]
+    
+    # Shared pooled HTTP client, so repeated lookups reuse the same TLS connection
+    response = get_http().get(f"https://open.er-api.com/v6/latest/{from_currency}", timeout=5.0)
+    response.raise_for_status()
+    data = orjson.loads(response.content)
+    
+    rates = data.get("rates")
+    if rates:
+        _RATES_CACHE[from_currency] = (time.time(), rates)
+    return rates
 
 @tool()
 def convert_currency(amount: float, from_currency: str, to_currency: str) -> str:
@@ -12,14 +34,12 @@ def convert_currency(amount: float, from_currency: str, to_currency: str) -> str
         - to_currency: Target currency code (e.g., EUR)
     """
     try:
-        url = f"https://open.er-api.com/v6/latest/{from_currency.upper()}"
-        with urllib.request.urlopen(url) as response:
-            data = json.loads(response.read())
+        rates = _get_rates(from_currency.upper())
             
-        if "rates" not in data:
+        if not rates:
             return "Error: Could not fetch exchange rates"
             
-        rate = data["rates"].get(to_currency.upper())
+        rate = rates.get(to_currency.upper())
         if not rate:
             return f"Error: No rate found for {to_currency}"
             
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The examples import their modules as top-level scripts from src/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+from cache import LLMCache
+from retry import call_with_retry
+import httpx
+import openai
+
+
+class FakeEmbeddings:
+    """Embeds every input to the same vector, like two near-identical queries."""
+
+    def create(self, model, input):
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[0.6, 0.8, 0.0])])
+
+
+class RateLimitedEmbeddings(FakeEmbeddings):
+    """Rejects the first request with a 429, like an account at its rate limit."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, model, input):
+        self.calls += 1
+        if self.calls == 1:
+            response = httpx.Response(429, request=httpx.Request("POST", "https://api.openai.com/v1/embeddings"))
+            raise openai.RateLimitError("Rate limit reached", response=response, body=None)
+        return super().create(model, input)
+
+
+def make_cache() -> LLMCache:
+    return LLMCache(SimpleNamespace(embeddings=FakeEmbeddings()))
+
+
+def conversion_plan(amount: float) -> dict:
+    return {
+        "requires_tools": True,
+        "thought": "Convert with the currency tool",
+        "plan": [f"Use convert_currency tool to convert {amount} USD to EUR"],
+        "tool_calls": [
+            {"tool": "convert_currency", "args": {"amount": amount, "from_currency": "USD", "to_currency": "EUR"}}
+        ]
+    }
+
+
+def test_queries_differing_only_in_amount_do_not_share_a_plan():
+    cache = make_cache()
+    cache.store(cache.embed("Convert 100 USD to EUR"), "Convert 100 USD to EUR", conversion_plan(100))
+    
+    assert cache.lookup(cache.embed("Convert 250 USD to EUR")) is None
+
+
+def test_direct_responses_are_reused_for_similar_queries():
+    cache = make_cache()
+    plan = {"requires_tools": False, "direct_response": "Japan uses the Japanese Yen (JPY)."}
+    cache.store(cache.embed("What currency does Japan use?"), "What currency does Japan use?", plan)
+    
+    assert cache.lookup(cache.embed("Which currency is used in Japan?")) == plan
+
+
+def test_rate_limited_embeddings_are_retried(monkeypatch):
+    monkeypatch.setattr(call_with_retry.retry, "sleep", lambda seconds: None)
+    embeddings = RateLimitedEmbeddings()
+    cache = LLMCache(SimpleNamespace(embeddings=embeddings))
+    
+    assert cache.embed("What currency does Japan use?").shape == (3,)
+    assert embeddings.calls == 2
@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+from main import Agent, JsonScanner
+import orjson
+import pytest
+
+
+def scan(*chunks: str) -> list:
+    scanner = JsonScanner()
+    return [scanner.feed(chunk) for chunk in chunks]
+
+
+def test_complete_only_at_the_closing_brace():
+    assert scan('{"amount": 100, ', '"to": {"currency": "EUR"}', "}") == [False, False, True]
+
+
+def test_braces_inside_strings_are_ignored():
+    assert scan('{"text": "}]"', "}") == [False, True]
+
+
+def test_escaped_quotes_do_not_end_the_string():
+    assert scan('{"text": "say \\"}\\" "', "}") == [False, True]
+
+
+def test_escaped_backslash_before_a_quote_ends_the_string():
+    assert scan('{"path": "C:\\\\"', "}") == [False, True]
+
+
+def test_escape_split_across_chunks():
+    assert scan('{"text": "\\', '"}', '"}') == [False, False, True]
+
+
+def test_arrays():
+    assert scan("[1, [2", "]", "]") == [False, False, True]
+
+
+def tool_call_chunk(arguments: str, name=None) -> SimpleNamespace:
+    function = SimpleNamespace(name=name, arguments=arguments)
+    delta = SimpleNamespace(content=None, tool_calls=[SimpleNamespace(index=0, function=function)])
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+def test_unparseable_arguments_are_not_reparsed_on_every_chunk(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")  # The shared context creates a default client
+    chunks = [tool_call_chunk('{"amount": 1}}', name="convert_currency")]
+    chunks += [tool_call_chunk(" ") for _ in range(10)]
+    completions = SimpleNamespace(create=lambda **kwargs: iter(chunks))
+    agent = Agent(client=SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    
+    parses = []
+    loads = orjson.loads
+    monkeypatch.setattr(orjson, "loads", lambda text: parses.append(text) or loads(text))
+    
+    with pytest.raises(ValueError):
+        agent.plan("Convert 1 USD to EUR", on_tool_call=lambda tool_call: pytest.fail("dispatched invalid arguments"))
+    # One attempt when the scanner completes, one on the full arguments after the stream
+    assert len(parses) == 2